@@ -5,6 +5,7 @@
 
 # import nipype modules
 import os  # system functions
+import sys
 import glob
 from argparse import ArgumentParser, RawDescriptionHelpFormatter
 from itertools import chain  # flattens lists
@@ -17,11 +18,18 @@ from nipype.interfaces.io import DataSink
 import nipype.interfaces.freesurfer as fs
 import nipype.interfaces.niftyreg as reg
 
+# shared stage profiling lives in utils/ at the top of the repository
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from utils.profiling import StageProfiler, add_profile_args
+from utils.profile_store import empty_profiles, save_profiles, pack_mgz_profiles
+
 
 # Arguments
 __description__ = '''
 This script uses freesurfer outputs and diffusion MRI maps and extracts ROI metrics at various distances from the
 WM surface. Main output is a csv file with average and standard deviations of specified ROIs at various distances.
+All sampled vertices are also saved as one profile store (<metric>_swm_profiles.npy/.json, see utils/profile_store.py)
+holding every hemisphere and distance, plus <metric>_swm_profiles_template.npy/.json if a template is given.
 '''
 
 # collect inputs
@@ -63,11 +71,27 @@ parser.add_argument('-r', '--rois',
                          'If none specified, all cortical FreeSurfer ROIs will be extracted.',
                     required=False,
                     nargs='+')
+parser.add_argument('-a', '--annot',
+                    help='Annotation to take ROIs from, read from label/<hemi>.<annot>.annot in fsdir (e.g. aparc or '
+                         'HOCP_labels from 7-Chapter/sample_labels2surface.py). Must be built on the same surface as '
+                         '--surf (e.g. sample_labels2surface.py -sf synth_white). Default is aparc (Desikan-Killiany).',
+                    required=False,
+                    default='aparc')
+parser.add_argument('-sf', '--surf',
+                    help='Surface in fsdir/surf to sample from (e.g. white or synth_white). Must match the surface '
+                         'the --annot was built on. Default is white.',
+                    required=False,
+                    default='white')
 parser.add_argument('-o', '--out_dir',
                     help='Output directory to put csv file with all data.',
                     required=True)
+add_profile_args(parser)
 args = parser.parse_args()
 
+profiler = StageProfiler('extract_swm', enabled=args.profile)
+# per-node runtime/memory for registration, resampling and each mri_vol2surf run (only with --profile)
+profiler.enable_nipype_monitor()
+
 # if output directory doesn't exist - create it
 if not os.path.exists(args.out_dir):
     os.makedirs(args.out_dir)
@@ -143,7 +167,7 @@ sampler = Node(fs.SampleToSurface(subjects_dir=os.path.dirname(os.path.abspath(a
                                   reg_file=dummy_reg_file,
                                   sampling_method='point',
                                   sampling_units='mm',
-                                  surface='white',
+                                  surface=args.surf,
                                   out_file=subj_dwi_file + '_swm_sampled.mgz'),
                name='mri_vol2surf')
 
@@ -155,7 +179,9 @@ wf.connect([(dwi2fst1_res, sampler,
 wf.connect([(sampler, swm_sinker,
              [('out_file', 'swm_sampled')])])
 
-wf.run('MultiProc', plugin_args={'n_procs': 4})
+# registration, resampling and mri_vol2surf all run in here (as child processes) - see Nipype_Nodes in the trace
+with profiler.stage('register_and_sample'):
+    wf.run('MultiProc', plugin_args=profiler.plugin_args({'n_procs': 4}))
 
 # if common space template specified - run the sampler interface again but sample to specified template (i.e. fsaverage)
 if args.template:
@@ -168,7 +194,7 @@ if args.template:
                                                reg_file=dummy_reg_file,
                                                sampling_method='point',
                                                sampling_units='mm',
-                                               surface='white',
+                                               surface=args.surf,
                                                target_subject=args.template,
                                                smooth_surf=5.0,
                                                out_file=subj_dwi_file + '_swm_sampled_template.mgz'),
@@ -189,7 +215,8 @@ if args.template:
                           [('out_file', 'swm_sampled_template')])])
 
     # run workflow
-    wf_template.run('MultiProc', plugin_args={'n_procs': 4})
+    with profiler.stage('sample_template'):
+        wf_template.run('MultiProc', plugin_args=profiler.plugin_args({'n_procs': 4}))
 
 ### extract ROIs using nibabel for native ROIs
 
@@ -197,8 +224,9 @@ hemi_list = []
 swm_dict = {}
 
 for i_hemi in args.hemis:
-    # get ROIs from Desikan-Killiany Atlas
-    annot_data = nfs.read_annot(os.path.join(os.path.abspath(args.fsdir), 'label/' + i_hemi + '.aparc.annot'))
+    # get ROIs from Desikan-Killiany Atlas (or other annotation)
+    annot_data = nfs.read_annot(os.path.join(os.path.abspath(args.fsdir),
+                                             'label/' + i_hemi + '.' + args.annot + '.annot'))
 
     # find indices of rois (label values) - use all rois if none specified
     if not args.rois:
@@ -218,9 +246,10 @@ for i_hemi in args.hemis:
                               sampler.inputs.out_file)
         print(i_file)
         # load dwi data sampled at distance in sampler node. Then get data into a reasonable format (vector)
-        swm_obj = nfs.mghformat.load(i_file)  # datasink instead
-        swm_data = swm_obj.get_data()
-        swm_data = swm_data.flatten()
+        with profiler.stage('load_sampled', Hemi=i_hemi, Distance=i_distance):
+            swm_obj = nfs.mghformat.load(i_file)  # datasink instead
+            swm_data = swm_obj.get_data()
+            swm_data = swm_data.flatten()
 
         # add data to dictionary
         swm_dict[i_hemi][i_distance] = swm_data
@@ -234,17 +263,18 @@ for i_hemi in args.hemis:
 
         # index vertices from dwi swm data for each roi (from gyri/sulci code)
         roi_list = []
-        for i_roi, i_gws in roi_dict.iteritems():
-            i_data = swm_dict[i_hemi][i_distance]
-            i_dict = OrderedDict()
-            i_dict['Hemi'] = i_hemi
-            i_dict['Distance'] = i_distance
-            i_dict['Region'] = i_roi
-            # Get mean and standard deviations of current ROI
-            i_dict['DWI_Avg'] = np.mean(i_data[roi_dict[i_roi]['mask']])
-            i_dict['DWI_Std'] = np.std(i_data[roi_dict[i_roi]['mask']])
-            # append this ROI dictionary to list
-            roi_list.append(i_dict)
+        with profiler.stage('roi_stats', Hemi=i_hemi, Distance=i_distance):
+            for i_roi, i_gws in roi_dict.iteritems():
+                i_data = swm_dict[i_hemi][i_distance]
+                i_dict = OrderedDict()
+                i_dict['Hemi'] = i_hemi
+                i_dict['Distance'] = i_distance
+                i_dict['Region'] = i_roi
+                # Get mean and standard deviations of current ROI
+                i_dict['DWI_Avg'] = np.mean(i_data[roi_dict[i_roi]['mask']])
+                i_dict['DWI_Std'] = np.std(i_data[roi_dict[i_roi]['mask']])
+                # append this ROI dictionary to list
+                roi_list.append(i_dict)
 
         # append dfs for different distances
         dist_list.append(roi_list)
@@ -259,7 +289,33 @@ final_swm_data = pd.concat([hemi_list[0], hemi_list[1]])
 
 # output csv for ROIs
 output_csv = subj_dwi_file + '_swm_roi_metrics.csv'
-final_swm_data.to_csv(os.path.join(os.path.abspath(swm_sinker.inputs.base_directory), output_csv), index=False)
+with profiler.stage('write_csv'):
+    final_swm_data.to_csv(os.path.join(os.path.abspath(swm_sinker.inputs.base_directory), output_csv), index=False)
+
+# save every sampled vertex in one store (hemi x distance x vertex x metric) rather than reading back all the .mgz files
+with profiler.stage('write_profile_store'):
+    n_vertices = dict((i_hemi, len(swm_dict[i_hemi][args.distances[0]])) for i_hemi in args.hemis)
+    profile_data = empty_profiles(args.hemis, args.distances, [subj_dwi_file], n_vertices)
+    for h, i_hemi in enumerate(args.hemis):
+        for d, i_distance in enumerate(args.distances):
+            profile_data[h, d, :n_vertices[i_hemi], 0] = swm_dict[i_hemi][i_distance]
+    save_profiles(os.path.join(os.path.abspath(swm_sinker.inputs.base_directory), subj_dwi_file + '_swm_profiles'),
+                  profile_data, os.path.abspath(args.fsdir), args.hemis, args.distances, [subj_dwi_file], n_vertices)
+
+    # template sampled profiles have the same vertices for every subject so can be stacked for group analysis
+    if args.template:
+        template_files = {}
+        for i_hemi in args.hemis:
+            for i_distance in args.distances:
+                template_files[(i_hemi, i_distance, subj_dwi_file)] = os.path.join(
+                    args.out_dir, wf_template.name, '_hemi_' + i_hemi + '_sampling_range_' + str(i_distance),
+                    sampler_template.name, sampler_template.inputs.out_file)
+        pack_mgz_profiles(os.path.join(os.path.abspath(swm_tp_sinker.inputs.base_directory),
+                                       subj_dwi_file + '_swm_profiles_template'),
+                          template_files, os.path.abspath(args.fsdir), args.hemis, args.distances, [subj_dwi_file])
+
+# write profiling outputs next to the csv (only if --profile)
+profiler.write(os.path.join(os.path.abspath(swm_sinker.inputs.base_directory), subj_dwi_file + '_swm'))
 
 
 # write graph out - this no longer works on linux - need graphviz stuff installed - install in niftypipe venv?
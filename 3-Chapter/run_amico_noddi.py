@@ -1,10 +1,16 @@
 #!/usr/bin/env python
 
 
+import os
+import sys
 from argparse import ArgumentParser, RawDescriptionHelpFormatter
 import amico
 import spams
 
+# shared stage profiling lives in utils/ at the top of the repository
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from utils.profiling import StageProfiler, add_profile_args
+
 # Arguments
 __description__ = '''
 This script fits the NODDI model using AMICO (Accelerated Microstructural Imaging via Convex Optimisation).
@@ -42,28 +48,34 @@ parser.add_argument('-b0', '--b0_threshold',
                     type=int,
                     default=0,
                     required=False)
+add_profile_args(parser)
 
 args = parser.parse_args()
 
-amico.core.setup()
+profiler = StageProfiler('run_amico_noddi', enabled=args.profile)
+
+with profiler.stage('setup'):
+    amico.core.setup()
 
-# give amico directory structure
-ae = amico.Evaluation(args.experiment_dir, args.subject_dir)
+    # give amico directory structure
+    ae = amico.Evaluation(args.experiment_dir, args.subject_dir)
 
-# generate scheme file if don't already have one
-scheme = amico.util.fsl2scheme(args.bval, args.bvec)
+    # generate scheme file if don't already have one
+    scheme = amico.util.fsl2scheme(args.bval, args.bvec)
 
 # load data
-ae.load_data(dwi_filename=args.dwi,
-             scheme_filename=scheme,
-             mask_filename=args.mask,
-             b0_thr=args.b0_threshold)
+with profiler.stage('load_data'):
+    ae.load_data(dwi_filename=args.dwi,
+                 scheme_filename=scheme,
+                 mask_filename=args.mask,
+                 b0_thr=args.b0_threshold)
 
 # set model
 ae.set_model('NODDI')
 
 # generate kernels
-ae.generate_kernels()
+with profiler.stage('generate_kernels'):
+    ae.generate_kernels()
 
 # Note that you need to compute the response functions only once per study;
 # in fact, scheme files with same b-values but different number/distribution of samples on each shell
@@ -73,10 +85,16 @@ ae.generate_kernels()
 
 # Load the precomputed kernels (at higher resolution) and adapt them to the actual scheme
 # (distribution of points on each shell) of the current subject:
-ae.load_kernels()
+with profiler.stage('load_kernels'):
+    ae.load_kernels()
 
 # fit model
-ae.fit()
+with profiler.stage('fit'):
+    ae.fit()
 
 # save results as nifti
-ae.save_results()
+with profiler.stage('save_results'):
+    ae.save_results()
+
+# write profiling outputs in the subject directory (only if --profile)
+profiler.write(os.path.join(args.experiment_dir, args.subject_dir, 'amico_noddi'))
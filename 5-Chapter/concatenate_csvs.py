@@ -3,9 +3,14 @@
 
 # load packages
 import os
+import sys
 import pandas as pd
 from argparse import ArgumentParser, RawDescriptionHelpFormatter
 
+# shared stage profiling lives in utils/ at the top of the repository
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from utils.profiling import StageProfiler, add_profile_args
+
 # get arguments
 __description__ = '''
 This script collates all csv's matching pattern and concatenates them into one long csv file.
@@ -30,39 +35,49 @@ parser.add_argument('-o', '--output',
                     help='Output csv file name with all data. Saved in parentdir.',
                     required=False,
                     default='all_csv_data.csv')
+add_profile_args(parser)
 args = parser.parse_args()
 
+profiler = StageProfiler('concatenate_csvs', enabled=args.profile)
+
 # get list of csvs
 dir_list = []
 indir = os.path.abspath(args.parent_dir)
 
-if args.sub_dir:
-    print('Subdirectory defined - only extracting csv files under this subdirectory:' + str(args.sub_dir))
-    for root, dirs, files in os.walk(indir):
-        if args.sub_dir in root:
+with profiler.stage('find_csvs'):
+    if args.sub_dir:
+        print('Subdirectory defined - only extracting csv files under this subdirectory:' + str(args.sub_dir))
+        for root, dirs, files in os.walk(indir):
+            if args.sub_dir in root:
+                for ifile in files:
+                    if ifile.endswith(str(args.ends_with)):
+                        print(os.path.join(root, ifile))
+                        dir_list.append(os.path.join(root, ifile))
+    else:
+        print('Extracting all csv files under parent directory' + str(args.parent_dir))
+        for root, dirs, files in os.walk(indir):
             for ifile in files:
                 if ifile.endswith(str(args.ends_with)):
                     print(os.path.join(root, ifile))
                     dir_list.append(os.path.join(root, ifile))
-else:
-    print('Extracting all csv files under parent directory' + str(args.parent_dir))
-    for root, dirs, files in os.walk(indir):
-        for ifile in files:
-            if ifile.endswith(str(args.ends_with)):
-                print(os.path.join(root, ifile))
-                dir_list.append(os.path.join(root, ifile))
 
 
 # loop through and create nested dictionaries of dfs
 csv_dict = {}
-for icsv in dir_list:
-    # read each file into a dataframe
-    csv_dict[icsv] = pd.read_csv(icsv)
-    # put the file name as a column in the data frame
-    csv_dict[icsv]['Filename'] = icsv
+with profiler.stage('read_csvs', N_Files=len(dir_list)):
+    for icsv in dir_list:
+        # read each file into a dataframe
+        csv_dict[icsv] = pd.read_csv(icsv)
+        # put the file name as a column in the data frame
+        csv_dict[icsv]['Filename'] = icsv
 
 # concatenate all files into one dataframe
-csv_all = pd.concat(csv_dict.values(), ignore_index=True)
+with profiler.stage('concatenate'):
+    csv_all = pd.concat(csv_dict.values(), ignore_index=True)
 
 # save to output csv
-csv_all.to_csv(os.path.join(args.parent_dir, args.output), index=False)
+with profiler.stage('write_csv'):
+    csv_all.to_csv(os.path.join(args.parent_dir, args.output), index=False)
+
+# write profiling outputs next to the output csv (only if --profile)
+profiler.write(os.path.splitext(os.path.join(args.parent_dir, args.output))[0])
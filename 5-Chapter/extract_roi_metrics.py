@@ -9,11 +9,20 @@ import pandas as pd
 from argparse import ArgumentParser, RawDescriptionHelpFormatter
 from collections import OrderedDict
 import os
+import sys
 import warnings
 
+# shared stage profiling lives in utils/ at the top of the repository
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from utils.profiling import StageProfiler, add_profile_args
+
 __description__ = '''
 This script extracts either descriptive statistics (mean,sd, sum, min, max) or volume from all regions of interest (ROI)
 of specified file and outputs a csv.
+If a weights image is given (e.g. tissue fraction 1-Viso, or a tissue probability map) tissue-weighted statistics are
+calculated in the same pass: weighted mean/SD for descriptive outputs and probabilistic volume for either output.
+ROIs containing NaN voxels give NaN for every statistic.
+All statistics are computed for every label at once rather than masking the image once per label.
 
 Author: Tom Veale
 Email: tom.veale@ucl.ac.uk
@@ -38,15 +47,25 @@ parser.add_argument('-m', '--output_metric',
 parser.add_argument('-p', '--probability',
                     help='The input image is a tissue probability map where each voxel ranges from 0.0-1.0 '
                          'representing the probability of that voxel belonging to that class. If this is chosen volume '
-                         'probabilities will also be calculated. NOT YET IMPLEMENTED.',
+                         'probabilities will also be calculated for either output metric (Volume_Prob, using the '
+                         'input image as the weights unless --weights is given).',
                     required=False,
                     action='store_true')
+parser.add_argument('-w', '--weights',
+                    help='Nifti file with voxel weights in the same space as the input image (e.g. tissue fraction '
+                         '1-Viso from NODDI, or a tissue probability map). Adds weighted mean and SD (descriptive) and '
+                         'probabilistic volume (Volume_Prob, either output metric) to the outputs, without writing a '
+                         'modulated image.',
+                    required=False)
 parser.add_argument('-o', '--out_file',
                     help='Output csv file (including path) containing ROI metrics. '
                          'Default path is in input_rois directory with the metric filename as a basename',
                     required=False)
+add_profile_args(parser)
 args = parser.parse_args()
 
+profiler = StageProfiler('extract_roi_metrics', enabled=args.profile)
+
 # check output is mean or volume
 if args.output_metric not in ["descriptive", "volume"]:
     raise ValueError("Output metric must be \'descriptive\' or \'volume\'")
@@ -57,76 +76,123 @@ if not args.out_file:
                                  os.path.basename(args.input_image.split('.')[0])) + '_rois.csv'
 
 # load in metric file (e.g. diffusion metric, MPM, T1 whatever)
-metric_img = nb.load(args.input_image)
-metric_data = metric_img.get_fdata()
+with profiler.stage('load_metric'):
+    metric_img = nb.load(args.input_image)
+    metric_data = metric_img.get_fdata()
 
 # load in label file (e.g. file with labels for each ROI such as GIF labels/freesurfer rois)
-roi_img = nb.load(args.input_rois)
-roi_data = roi_img.get_fdata()
-
-# loop through each label value and extract mean and SD of underlying metrics
-# get unique label values in roi_data
-roi_vals = np.unique(roi_data).astype(int)
-
-# initiate roi list
-roi_list = []
-
-# if using descriptive
-if args.output_metric == "descriptive":
-    # for each label in roi_data - extract mean and sd
-    for i_roi in roi_vals:
-        # create dict
-        i_dict = OrderedDict()
-        i_dict['Filename'] = args.input_image
-        i_dict['ROI_Value'] = i_roi
-        # extract mean
-        i_dict['Mean'] = np.mean(metric_data[roi_data == i_roi])
-        # extract std
-        i_dict['SD'] = np.std(metric_data[roi_data == i_roi])
-        # extract sum of metric in ROI
-        i_dict['Sum'] = np.sum(metric_data[roi_data == i_roi])
-        # extract min of metric in ROI
-        i_dict['Min'] = np.min(metric_data[roi_data == i_roi])
-        # extract max of metric in ROI
-        i_dict['Max'] = np.max(metric_data[roi_data == i_roi])
-        # extract median of metric in ROI
-        i_dict['Median'] = np.median(metric_data[roi_data == i_roi])
-        # extract lower and upper quartile for inter-quartile range
-        i_dict['q25'], i_dict['q75'] = np.percentile(metric_data[roi_data == i_roi], [25, 75])
-        # append dict to list
-        roi_list.append(i_dict)
-
-# if using volume
-elif args.output_metric == "volume":
+with profiler.stage('load_rois'):
+    roi_img = nb.load(args.input_rois)
+    roi_data = roi_img.get_fdata()
+
+# load in weights file (e.g. tissue fraction/probability map) - only once, used for every label below
+weights_data = None
+if args.weights:
+    with profiler.stage('load_weights'):
+        weights_data = nb.load(args.weights).get_fdata()
+    if weights_data.shape != metric_data.shape:
+        raise ValueError('Weights image ' + str(weights_data.shape) + ' and input image ' + str(metric_data.shape) +
+                         ' must have the same dimensions')
+
+# probabilistic volumes use the weights if given, otherwise the input image is the probability map
+if weights_data is not None:
+    prob_data = weights_data
+elif args.probability:
+    prob_data = metric_data
+else:
+    prob_data = None
+
+with profiler.stage('roi_stats'):
+    # get unique label values in roi_data and the label index of every voxel - all statistics are then grouped sums
+    # over these indices (np.bincount) so each image is only scanned a handful of times regardless of number of labels
+    roi_vals, roi_index = np.unique(roi_data.ravel(), return_inverse=True)
+    roi_index = roi_index.ravel()
+    n_rois = len(roi_vals)
+    roi_count = np.bincount(roi_index, minlength=n_rois)
+
+    # initiate roi columns
+    roi_cols = OrderedDict()
+    roi_cols['Filename'] = args.input_image
+    roi_cols['ROI_Value'] = roi_vals.astype(int)
+
+    # if using descriptive
+    if args.output_metric == "descriptive":
+        metric_vals = metric_data.ravel()
+
+        # extract sum, mean and std (two-pass like np.std) of metric in each ROI
+        roi_sum = np.bincount(roi_index, weights=metric_vals, minlength=n_rois)
+        roi_mean = roi_sum / roi_count
+        roi_sq = np.bincount(roi_index, weights=(metric_vals - roi_mean[roi_index]) ** 2, minlength=n_rois)
+        roi_cols['Mean'] = roi_mean
+        roi_cols['SD'] = np.sqrt(roi_sq / roi_count)
+        roi_cols['Sum'] = roi_sum
+
+        # sort voxels by label then metric value - each ROI is then a contiguous sorted block
+        # so min, max, median and quartiles can be read off directly
+        order = np.lexsort((metric_vals, roi_index))
+        sorted_vals = metric_vals[order]
+        roi_first = np.cumsum(roi_count) - roi_count
+        roi_last = roi_first + roi_count - 1
+        roi_cols['Min'] = sorted_vals[roi_first]
+        roi_cols['Max'] = sorted_vals[roi_last]
+
+        # percentiles with linear interpolation between the closest ranks (same as np.percentile default)
+        roi_pct = {}
+        for i_pct in [25, 50, 75]:
+            pos = roi_first + (i_pct / 100.0) * (roi_count - 1)
+            lower = np.floor(pos).astype(int)
+            upper = np.minimum(lower + 1, roi_last)
+            roi_pct[i_pct] = sorted_vals[lower] + (pos - lower) * (sorted_vals[upper] - sorted_vals[lower])
+        roi_cols['Median'] = roi_pct[50]
+        roi_cols['q25'] = roi_pct[25]
+        roi_cols['q75'] = roi_pct[75]
+
+        # NaN voxels sort to the end of each block, so the order statistics above would be biased - ROIs containing
+        # any NaN give NaN for every statistic (as np.mean/np.min/np.percentile etc. do)
+        roi_has_nan = np.bincount(roi_index, weights=np.isnan(metric_vals), minlength=n_rois) > 0
+        for i_col in ['Min', 'Max', 'Median', 'q25', 'q75']:
+            roi_cols[i_col][roi_has_nan] = np.nan
+
+        # tissue-weighted mean and SD - sum(weights * metric) / sum(weights)
+        # equivalent to averaging a modulated image and dividing by the average weight
+        if weights_data is not None:
+            weight_vals = weights_data.ravel()
+            roi_weight_sum = np.bincount(roi_index, weights=weight_vals, minlength=n_rois)
+            with np.errstate(invalid='ignore', divide='ignore'):
+                roi_wmean = np.bincount(roi_index, weights=weight_vals * metric_vals, minlength=n_rois) / roi_weight_sum
+                roi_wsq = np.bincount(roi_index, weights=weight_vals * (metric_vals - roi_wmean[roi_index]) ** 2,
+                                      minlength=n_rois)
+                roi_cols['Weighted_Mean'] = roi_wmean
+                roi_cols['Weighted_SD'] = np.sqrt(roi_wsq / roi_weight_sum)
+            roi_cols['Weight_Sum'] = roi_weight_sum
+
     # get image dimensions
     # inspired by nibabel package
     # https://github.com/nipy/nibabel/blob/master/nibabel/imagestats.py
     voxel_volume_mm3 = np.prod(metric_img.header.get_zooms()[:3])
 
-    if voxel_volume_mm3 != 1:
+    if voxel_volume_mm3 != 1 and (args.output_metric == "volume" or prob_data is not None):
         warnings.warn('Voxel dimensions are ' + str(voxel_volume_mm3) + "mm", UserWarning)
 
-    # for each label in roi_data - extract volume
-    for i_roi in roi_vals:
-        # create dict
-        i_dict = OrderedDict()
-        i_dict['Filename'] = args.input_image
-        i_dict['ROI_Value'] = i_roi
+    # if using volume
+    if args.output_metric == "volume":
         # extract volume
         # this is sum of voxels within the mask multiplied by the voxel dimensions
-        i_dict['Volume_Cat'] = np.sum(roi_data == i_roi) * voxel_volume_mm3
-        # for weighted average - not yet implemented
-        # if args.probability:
-            # weighted average - where tissue probability are the weights. element-wise: weights * vol / sum(weights)
-            # need to check this is right
-            #i_dict['Volume_Prob'] = (np.multiply(metric_data[roi_data == i_roi], roi_data == i_roi) / np.sum(metric_data[roi_data == i_roi])
-        # append dict to list
-        roi_list.append(i_dict)
+        roi_cols['Volume_Cat'] = roi_count * voxel_volume_mm3
 
+    # probabilistic volume (either output metric) - sum of tissue probabilities within the mask multiplied by the
+    # voxel dimensions
+    if prob_data is not None:
+        roi_prob_sum = np.bincount(roi_index, weights=prob_data.ravel(), minlength=n_rois)
+        roi_cols['Volume_Prob'] = roi_prob_sum * voxel_volume_mm3
 
 
-# convert list of dicts to data frame
-roi_df = pd.DataFrame(roi_list)
+# convert columns to data frame
+roi_df = pd.DataFrame(roi_cols)
 # output to csv
-roi_df.to_csv(args.out_file, index=False)
+with profiler.stage('write_csv'):
+    roi_df.to_csv(args.out_file, index=False)
 print('Saved metric csv file to: ', args.out_file)
+
+# write profiling outputs next to the csv (only if --profile)
+profiler.write(os.path.splitext(args.out_file)[0])
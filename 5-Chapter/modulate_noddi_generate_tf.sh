@@ -1,6 +1,7 @@
 #!/bin/bash
 # Calculates NDI and ODI images that are modulated by 1-iso (i.e. tissue-fraction).
 # These can then be taken into ROI analysis to create tissue weighted averages
+# Alternatively pass the _TF image to extract_roi_metrics.py --weights to get tissue weighted averages without the modulated images
 # see https://github.com/tdveale/TissueWeightedMean for more details
 
 iso=$1
@@ -0,0 +1,59 @@
+import os
+import sys
+from argparse import ArgumentParser, RawDescriptionHelpFormatter
+
+# shared profile store lives in utils/ at the top of the repository
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from utils.profile_store import pack_mgz_profiles
+
+# get arguments
+__description__ = '''
+This script packs the per hemisphere x distance .mgz files written by sample_hmri_profile.sh for one session into a
+single profile store (<srcSubj>_profiles.npy/.json in $sessDir/surf) holding every metric, hemisphere and distance.
+Run it once all metrics have been sampled. Stores are on each session's own surface, so stacking them across the cohort
+with utils/stack_profile_stores.py needs -ew _profiles.npy --allow_native (vertex indices do not correspond across
+sessions).
+
+Author: Tom Veale
+Email: tom.veale@ucl.ac.uk
+'''
+
+# collect inputs
+parser = ArgumentParser(formatter_class=RawDescriptionHelpFormatter,
+                        description=__description__)
+
+parser.add_argument('-s', '--sess_dir',
+                    help='Session directory used in sample_hmri_profile.sh '
+                         '(e.g. /path/to/all/data/s001/anat/s001_7T_MR1)',
+                    required=True)
+parser.add_argument('-m', '--metrics',
+                    help='Metric names used in sample_hmri_profile.sh (e.g. R1 MT R2s)',
+                    required=True,
+                    nargs='+')
+parser.add_argument('-d', '--distances',
+                    help='Distances sampled, written exactly as in sample_hmri_profile.sh. '
+                         'Default 1 0.5 0 -0.5 -1 -1.5 -2',
+                    required=False,
+                    nargs='+',
+                    default=['1', '0.5', '0', '-0.5', '-1', '-1.5', '-2'])
+parser.add_argument('-hm', '--hemis',
+                    help='Hemispheres sampled (e.g. lh rh). Default is both hemispheres.',
+                    required=False,
+                    nargs='+',
+                    default=['lh', 'rh'])
+args = parser.parse_args()
+
+# split session dir to get source subject (e.g. s001_7T_MR1)
+sess_dir = os.path.abspath(args.sess_dir)
+src_subj = os.path.basename(sess_dir)
+
+# same naming as sample_hmri_profile.sh: ${sessDir}/surf/${ihemi}.${metricName}_profile${idist}mm.mgz
+mgz_files = {}
+for i_hemi in args.hemis:
+    for i_dist in args.distances:
+        for i_metric in args.metrics:
+            mgz_files[(i_hemi, i_dist, i_metric)] = os.path.join(sess_dir, 'surf', i_hemi + '.' + i_metric +
+                                                                 '_profile' + i_dist + 'mm.mgz')
+
+pack_mgz_profiles(os.path.join(sess_dir, 'surf', src_subj + '_profiles'), mgz_files,
+                  sess_dir, args.hemis, args.distances, args.metrics)
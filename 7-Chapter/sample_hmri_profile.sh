@@ -25,3 +25,6 @@ for ihemi in ${hemis[@]}; do
     mri_vol2surf --src ${metric} --srcreg ${dataDir}/identity.dat --srcsubject ${srcSubj} --hemi ${ihemi} --surf synth_white --sd ${subjDir} --projdist ${idist} --o ${sessDir}/surf/${ihemi}.${metricName}_profile${idist}mm.mgz
   done
 done
+
+# once all metrics are sampled for this session, pack the .mgz files into one profile store for group analysis, e.g.
+# python pack_profiles.py -s ${sessDir} -m R1 MT R2s
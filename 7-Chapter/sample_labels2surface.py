@@ -0,0 +1,218 @@
+import os
+import sys
+import warnings
+from argparse import ArgumentParser, RawDescriptionHelpFormatter
+from concurrent.futures import ProcessPoolExecutor
+import nibabel as nb
+import numpy as np
+from nibabel import freesurfer as nfs
+
+# shared surface geometry helpers live in utils/ at the top of the repository
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from utils.surface_geometry import surface_ras2vox
+
+# get arguments
+__description__ = '''
+This script samples atlas labels onto participant surfaces (e.g. synth_white from surface_from_synthseg.sh) and writes
+a FreeSurfer .annot per hemisphere to $sessDir/label/${hemi}.${name}.annot, which extract_swm.py can read with --annot
+(run extract_swm.py with --surf set to the same surface).
+It replaces sample_labels2surface.sh: labels are looked up for all vertices at once (no mri_vol2surf call and no
+interpolated label values) and sessions are processed in parallel.
+Labels and surfaces must already be in the same (scanner) space, as identity.dat assumes in the bash version, but the
+label image can be on any grid - the volume info stored in the surface (e.g. orig.mgz for white) maps vertices to it.
+
+Label lookup methods:
+    nearest  - label of the voxel centre closest to the vertex
+    majority - label with the most (distance weighted) votes from the 8 voxels around the vertex, ignoring unlabelled
+               (0) voxels unless all 8 are unlabelled. More robust for vertices sitting on a label boundary.
+
+Author: Tom Veale
+Email: tom.veale@ucl.ac.uk
+'''
+
+
+def lookup_labels(label_data, ras2vox, coords, method):
+    """Return the label value under each vertex (coords are tkr RAS, one row per vertex)."""
+    vox = nb.affines.apply_affine(ras2vox, coords)
+    max_index = np.array(label_data.shape[:3]) - 1
+
+    if method == 'nearest':
+        ijk = np.clip(np.rint(vox).astype(int), 0, max_index)
+        return label_data[ijk[:, 0], ijk[:, 1], ijk[:, 2]]
+
+    # majority - the 8 voxels around each vertex, weighted by trilinear (distance) weights
+    base = np.floor(vox).astype(int)
+    frac = vox - base
+    cand_labels = []
+    cand_weights = []
+    for corner in np.ndindex(2, 2, 2):
+        corner = np.array(corner)
+        ijk = np.clip(base + corner, 0, max_index)
+        cand_labels.append(label_data[ijk[:, 0], ijk[:, 1], ijk[:, 2]])
+        cand_weights.append(np.prod(np.where(corner == 1, frac, 1 - frac), axis=1))
+    cand_labels = np.stack(cand_labels, axis=1)
+    cand_weights = np.stack(cand_weights, axis=1)
+
+    # unlabelled voxels don't vote - vertices with no labelled neighbours stay 0
+    cand_weights[cand_labels == 0] = 0
+    # votes for each candidate = summed weight of all candidates with the same label
+    # (one candidate at a time so memory stays at vertices x 8 for large 7T surfaces)
+    votes = np.zeros(cand_weights.shape, dtype=np.float32)
+    for j in range(cand_labels.shape[1]):
+        votes[:, j] = np.sum(cand_weights * (cand_labels == cand_labels[:, j:j + 1]), axis=1)
+    winner = cand_labels[np.arange(len(cand_labels)), np.argmax(votes, axis=1)]
+    winner[cand_weights.sum(axis=1) == 0] = 0
+    return winner
+
+
+def label_colour(label_val, used):
+    """
+    Colour [R, G, B] for a label value not already in used (set of RGB tuples). Derived from the value itself so a label
+    gets the same colour in every hemisphere and session (multiplying by an odd number is a bijection on 24 bit
+    integers), stepping on only if it clashes with a colour in used.
+    """
+    rgb = (label_val * 2654435761) & 0xFFFFFF
+    while rgb == 0 or (rgb >> 16 & 255, rgb >> 8 & 255, rgb & 255) in used:
+        rgb = (rgb + 1) & 0xFFFFFF
+    return [rgb >> 16 & 255, rgb >> 8 & 255, rgb & 255]
+
+
+def read_lut(lut_file):
+    """
+    Read a FreeSurfer colour lookup table (value name R G B A) into a dict of value -> (name, [R, G, B, A]).
+    Annot files identify labels by colour, so labels sharing a colour (e.g. ctx-lh-* and ctx-rh-* in
+    FreeSurferColorLUT.txt) would be merged on reading - repeats are given a new colour here, over the whole table,
+    so the colours used do not depend on which labels a hemisphere/session happens to contain.
+    """
+    lut = {}
+    with open(lut_file) as lut_txt:
+        for line in lut_txt:
+            fields = line.split()
+            if len(fields) < 5 or fields[0].startswith('#'):
+                continue
+            alpha = int(fields[5]) if len(fields) > 5 else 0
+            lut[int(fields[0])] = (fields[1], [int(i) for i in fields[2:5]] + [alpha])
+
+    # black is reserved for unknown (value 0)
+    used = set([(0, 0, 0)])
+    changed = []
+    for i_val in sorted(lut):
+        if i_val == 0:
+            continue
+        i_name, i_rgba = lut[i_val]
+        if tuple(i_rgba[:3]) in used:
+            i_rgba = label_colour(i_val, used) + i_rgba[3:]
+            lut[i_val] = (i_name, i_rgba)
+            changed.append(i_name)
+        used.add(tuple(i_rgba[:3]))
+    if changed:
+        warnings.warn(str(len(changed)) + ' labels in ' + lut_file + ' share a colour with another label and were '
+                      'given new colours (e.g. ' + changed[0] + ')', UserWarning)
+    return lut
+
+
+def build_ctab(label_vals, lut):
+    """Colour table and names for the labels found, 'unknown' (value 0) first as in FreeSurfer annotations."""
+    label_vals = [0] + [int(i) for i in label_vals if i != 0]
+    lut_colours = set(tuple(i_rgba[:3]) for i_name, i_rgba in lut.values()) | set([(0, 0, 0)])
+    names = []
+    ctab = []
+    for i_val in label_vals:
+        if i_val in lut:
+            i_name, i_rgba = lut[i_val]
+        elif i_val == 0:
+            i_name, i_rgba = 'unknown', [0, 0, 0, 0]
+        else:
+            i_name, i_rgba = 'label_' + str(i_val), label_colour(i_val, lut_colours) + [0]
+        names.append(i_name)
+        ctab.append(list(i_rgba))
+
+    if len(set(tuple(i_rgba[:3]) for i_rgba in ctab)) != len(ctab):
+        raise ValueError('Labels ' + str(label_vals) + ' do not have unique colours - annotation labels would merge')
+    return label_vals, np.array(ctab, dtype=np.int32), names
+
+
+def sample_session(label_file, sess_dir, hemis, surf, annot_name, method, lut):
+    """Sample one label volume onto each hemisphere of one session and write the .annot files."""
+    label_img = nb.load(label_file)
+    label_data = np.rint(np.asarray(label_img.dataobj)).astype(np.int32)
+
+    label_dir = os.path.join(sess_dir, 'label')
+    if not os.path.exists(label_dir):
+        os.makedirs(label_dir)
+
+    annot_files = []
+    for i_hemi in hemis:
+        coords, faces, vol_info = nfs.read_geometry(os.path.join(sess_dir, 'surf', i_hemi + '.' + surf),
+                                                    read_metadata=True)
+        vertex_labels = lookup_labels(label_data, surface_ras2vox(label_img, vol_info), coords, method)
+
+        # annot labels are indices into the colour table
+        label_vals, ctab, names = build_ctab(np.unique(vertex_labels), lut)
+        annot_index = np.searchsorted(label_vals[1:], vertex_labels) + 1
+        annot_index[vertex_labels == 0] = 0
+
+        annot_file = os.path.join(label_dir, i_hemi + '.' + annot_name + '.annot')
+        nfs.write_annot(annot_file, annot_index, ctab, names, fill_ctab=True)
+        annot_files.append(annot_file)
+    return annot_files
+
+
+if __name__ == '__main__':
+    # collect inputs
+    parser = ArgumentParser(formatter_class=RawDescriptionHelpFormatter,
+                            description=__description__)
+
+    parser.add_argument('-l', '--labels',
+                        help='Atlas labels in participant native space, one per session and in the same order as '
+                             '--sess_dirs (e.g. /path/to/all/data/s001/anat/HOCP_labels.nii.gz)',
+                        required=True,
+                        nargs='+')
+    parser.add_argument('-s', '--sess_dirs',
+                        help='Session directories with a freesurfer-like tree (i.e. $sessDir/surf/lh.synth_white) '
+                             '(e.g. /path/to/all/data/s001/anat/s001_7T_MR1)',
+                        required=True,
+                        nargs='+')
+    parser.add_argument('-n', '--name',
+                        help='Annotation name - output is $sessDir/label/${hemi}.${name}.annot. Default HOCP_labels',
+                        required=False,
+                        default='HOCP_labels')
+    parser.add_argument('-lut', '--lookup_table',
+                        help='FreeSurfer style colour lookup table for label names/colours '
+                             '(e.g. FreeSurferColorLUT.txt). Labels not in the table are named label_<value>.',
+                        required=False)
+    parser.add_argument('-sf', '--surf',
+                        help='Surface to sample onto. Default synth_white. extract_swm.py --annot needs the same '
+                             'surface as its --surf (e.g. use -sf white with extract_swm.py defaults).',
+                        required=False,
+                        default='synth_white')
+    parser.add_argument('-hm', '--hemis',
+                        help='Hemispheres to sample (e.g. lh rh). Default is both hemispheres.',
+                        required=False,
+                        nargs='+',
+                        default=['lh', 'rh'])
+    parser.add_argument('-mt', '--method',
+                        help='Label lookup method: \'nearest\' or \'majority\'. Default majority',
+                        required=False,
+                        default='majority')
+    parser.add_argument('-np', '--n_procs',
+                        help='Number of sessions to process in parallel. Default 4',
+                        required=False,
+                        type=int,
+                        default=4)
+    args = parser.parse_args()
+
+    if args.method not in ['nearest', 'majority']:
+        raise ValueError('Method must be \'nearest\' or \'majority\'')
+    if len(args.labels) != len(args.sess_dirs):
+        raise ValueError('Give one label file per session directory')
+
+    lut = read_lut(args.lookup_table) if args.lookup_table else {}
+
+    with ProcessPoolExecutor(max_workers=args.n_procs) as pool:
+        jobs = [pool.submit(sample_session, os.path.abspath(i_label), os.path.abspath(i_sess), args.hemis, args.surf,
+                            args.name, args.method, lut)
+                for i_label, i_sess in zip(args.labels, args.sess_dirs)]
+        for i_job in jobs:
+            for i_annot in i_job.result():
+                print('Saved annotation to: ', i_annot)
@@ -1,5 +1,6 @@
 #!/bin/bash
 # samples labels from atlas onto participant surfaces
+# see sample_labels2surface.py for a faster version that looks up labels directly (no interpolation) and writes a true .annot
 # this is essentially the same as sample_hmri_profile.sh but put into a different script for clarity - only samples on the GM/WM boundary (projdist=0)
 # requires a freesurfer-like directory tree (i.e. $sessDir/surf/lh.synth_white)
 # identity.dat is an identity matrix file as labels and surface should be in the same space already
@@ -0,0 +1,121 @@
+import os
+import sys
+from argparse import ArgumentParser, RawDescriptionHelpFormatter
+from concurrent.futures import ProcessPoolExecutor
+import nibabel as nb
+import numpy as np
+from nibabel import freesurfer as nfs
+from scipy import sparse
+from skimage.measure import marching_cubes
+
+# shared surface geometry helpers live in utils/ at the top of the repository
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from utils.surface_geometry import vox2ras_tkr, volume_info
+
+# get arguments
+__description__ = '''
+Create GM/WM surfaces from SynthSeg output (https://github.com/BBillot/SynthSeg).
+Python version of surface_from_synthseg.sh without FSL: the SynthSeg image is loaded once and both hemisphere WM masks
+are built in one pass (no mask files written), then each hemisphere is tessellated (marching cubes) and Taubin smoothed
+in parallel. Output is ${hemi}.synth_white in FreeSurfer format (tkr RAS coordinates, like mri_tessellate).
+Could be improved with other FreeSurfer commands (e.g. topology correction).
+
+Author: Tom Veale
+Email: tom.veale@ucl.ac.uk
+'''
+
+# SynthSeg labels making up each hemisphere's WM mask (same thresholds as the fslmaths calls in the bash version)
+HEMI_LABELS = {'lh': [1, 2], 'rh': [40, 41]}
+
+
+def taubin_smooth(coords, faces, iterations, lamb=0.5, mu=-0.53):
+    """
+    Taubin (lambda/mu) smoothing - a Laplacian step followed by an inflating step so the surface does not shrink.
+    The umbrella Laplacian (mean of neighbours - vertex) is applied to all vertices at once as a sparse matrix.
+    """
+    n_vertices = len(coords)
+    edges = np.concatenate([faces[:, [0, 1]], faces[:, [1, 2]], faces[:, [2, 0]]])
+    adjacency = sparse.coo_matrix((np.ones(len(edges)), (edges[:, 0], edges[:, 1])), shape=(n_vertices, n_vertices))
+    adjacency = ((adjacency + adjacency.T) > 0).astype(float).tocsr()
+    n_neighbours = np.asarray(adjacency.sum(axis=1)).ravel()
+    n_neighbours[n_neighbours == 0] = 1
+    neighbour_mean = sparse.diags(1.0 / n_neighbours).dot(adjacency)
+
+    coords = coords.copy()
+    for i in range(iterations):
+        coords += lamb * (neighbour_mean.dot(coords) - coords)
+        coords += mu * (neighbour_mean.dot(coords) - coords)
+    return coords
+
+
+def make_surface(mask, offset, tkr_affine, out_file, iterations, vol_info):
+    """Tessellate one (cropped) hemisphere mask, smooth it and write it as a FreeSurfer surface."""
+    # pad so the surface is closed where the mask touches the edge of the crop
+    verts, faces = marching_cubes(np.pad(mask, 1).astype(np.float32), level=0.5)[:2]
+    coords = nb.affines.apply_affine(tkr_affine, verts - 1 + offset)
+
+    # FreeSurfer expects faces ordered so normals point outwards (positive enclosed volume) - the voxel -> RAS
+    # transform can flip handedness, so check and reverse the winding if needed
+    v0, v1, v2 = coords[faces[:, 0]], coords[faces[:, 1]], coords[faces[:, 2]]
+    if np.sum(v0 * np.cross(v1, v2)) < 0:
+        faces = faces[:, ::-1]
+
+    coords = taubin_smooth(coords, faces, iterations)
+    nfs.write_geometry(out_file, coords, np.ascontiguousarray(faces), volume_info=vol_info)
+    return out_file
+
+
+if __name__ == '__main__':
+    # collect inputs
+    parser = ArgumentParser(formatter_class=RawDescriptionHelpFormatter,
+                            description=__description__)
+
+    parser.add_argument('-i', '--synthseg',
+                        help='SynthSeg output (e.g. /path/to/all/data/s001/anat/s001_7T_MR1_synthseg.nii.gz)',
+                        required=True)
+    parser.add_argument('-o', '--out_dir',
+                        help='Output directory for surfaces (e.g. /path/to/all/data/s001/anat/s001_7T_MR1/surf)',
+                        required=True)
+    parser.add_argument('-n', '--iterations',
+                        help='Number of Taubin smoothing iterations. Default 10 (as mris_smooth)',
+                        required=False,
+                        type=int,
+                        default=10)
+    parser.add_argument('-hm', '--hemis',
+                        help='Hemispheres to create surfaces for (e.g. lh rh). Default is both hemispheres.',
+                        required=False,
+                        nargs='+',
+                        default=['lh', 'rh'])
+    args = parser.parse_args()
+
+    # if output directory doesn't exist - create it
+    if not os.path.exists(args.out_dir):
+        os.makedirs(args.out_dir)
+
+    # load SynthSeg once and label every voxel with its hemisphere index in one lookup (0 = neither)
+    seg_img = nb.load(args.synthseg)
+    seg_data = np.rint(np.asarray(seg_img.dataobj)).astype(np.int32)
+    hemi_lut = np.zeros(max(max(HEMI_LABELS[i_hemi]) for i_hemi in args.hemis) + 1, dtype=np.uint8)
+    for h, i_hemi in enumerate(args.hemis):
+        hemi_lut[HEMI_LABELS[i_hemi]] = h + 1
+    hemi_data = hemi_lut[np.clip(seg_data, 0, len(hemi_lut) - 1)]
+    hemi_data[seg_data >= len(hemi_lut)] = 0
+
+    tkr_affine = vox2ras_tkr(seg_img)
+    vol_info = volume_info(seg_img, os.path.abspath(args.synthseg))
+
+    # crop each mask to its bounding box so only the hemisphere is sent to (and tessellated by) each worker
+    with ProcessPoolExecutor(max_workers=len(args.hemis)) as pool:
+        jobs = []
+        for h, i_hemi in enumerate(args.hemis):
+            i_mask = hemi_data == h + 1
+            if not i_mask.any():
+                raise ValueError('No voxels labelled ' + str(HEMI_LABELS[i_hemi]) + ' (' + i_hemi + ' WM) in ' +
+                                 args.synthseg)
+            i_vox = np.argwhere(i_mask)
+            i_min, i_max = i_vox.min(axis=0), i_vox.max(axis=0) + 1
+            i_crop = i_mask[i_min[0]:i_max[0], i_min[1]:i_max[1], i_min[2]:i_max[2]]
+            jobs.append(pool.submit(make_surface, i_crop, i_min, tkr_affine,
+                                    os.path.join(args.out_dir, i_hemi + '.synth_white'), args.iterations, vol_info))
+        for i_job in jobs:
+            print('Saved surface to: ', i_job.result())
@@ -1,5 +1,6 @@
 #!/bin/bash
 # Create GM/WM surface from synthseg output https://github.com/BBillot/SynthSeg
+# see surface_from_synthseg.py for a version without FSL that builds both masks in memory and runs hemispheres in parallel
 # Could be improved with other FreeSurfer commands (e.g. topology correction)
 
 # Input and output parameters
@@ -0,0 +1,64 @@
+# collates the *_trace.json files written by scripts run with --profile into one csv
+# useful for finding which stage is the bottleneck across a whole cohort
+
+# load packages
+import os
+import json
+import pandas as pd
+from argparse import ArgumentParser, RawDescriptionHelpFormatter
+
+# get arguments
+__description__ = '''
+This script collates all profiling traces (*_trace.json) under a parent directory into one long csv with a row per
+stage (and nipype node) per run, and prints the total and median time of each stage across runs.
+
+Author: Tom Veale
+Email: tom.veale@ucl.ac.uk
+'''
+
+# collect inputs
+parser = ArgumentParser(formatter_class=RawDescriptionHelpFormatter,
+                        description=__description__)
+
+parser.add_argument('-pd', '--parent_dir',
+                    help='Path to the parent data directory the traces are located in (BIDS preferred)',
+                    required=True)
+parser.add_argument('-o', '--output',
+                    help='Output csv file name with all stages. Saved in parentdir.',
+                    required=False,
+                    default='all_profile_stages.csv')
+args = parser.parse_args()
+
+# get list of traces
+trace_list = []
+indir = os.path.abspath(args.parent_dir)
+for root, dirs, files in os.walk(indir):
+    for ifile in files:
+        if ifile.endswith('_trace.json'):
+            trace_list.append(os.path.join(root, ifile))
+
+if not trace_list:
+    raise ValueError('No profiling traces ending with _trace.json found under ' + indir)
+
+# one row per stage, labelled with the script and trace it came from
+stage_list = []
+for itrace in trace_list:
+    with open(itrace) as trace_file:
+        trace = json.load(trace_file)
+    for i_stage in trace['Stages']:
+        i_stage['Script'] = trace['Script']
+        i_stage['Filename'] = itrace
+        stage_list.append(i_stage)
+    # nipype nodes (registration, resampling, each mri_vol2surf run) are rows too, prefixed with nipype:
+    for i_node in trace.get('Nipype_Nodes', []):
+        i_node['Stage'] = 'nipype:' + i_node['Node']
+        i_node['Script'] = trace['Script']
+        i_node['Filename'] = itrace
+        stage_list.append(i_node)
+
+stage_df = pd.DataFrame(stage_list)
+stage_df.to_csv(os.path.join(args.parent_dir, args.output), index=False)
+
+# summarise where the time goes
+summary = stage_df.groupby(['Script', 'Stage'])[['Wall_s', 'CPU_s', 'Child_CPU_s']].agg(['sum', 'median'])
+print(summary.sort_values(('Wall_s', 'sum'), ascending=False))
@@ -0,0 +1,89 @@
+"""
+Compact per-subject store for metrics sampled on the surface at several distances (cortical/SWM profiles).
+
+Instead of one .mgz per hemisphere x distance (x metric), all of a subject's profiles are kept in two files:
+    <prefix>.npy   float32 array of shape (hemi, distance, vertex, metric). Hemispheres with fewer vertices than the
+                   largest are padded with NaN.
+    <prefix>.json  metadata - subject (absolute path of the subject's freesurfer/session directory), hemis, distances,
+                   metrics and number of vertices in each hemisphere.
+The .npy is uncompressed so it can be memory-mapped, letting a whole cohort be stacked into one array
+(see utils/stack_profile_stores.py) without loading every subject into memory.
+
+Author: Tom Veale (tom.veale@ucl.ac.uk)
+"""
+
+from __future__ import print_function
+
+import json
+from collections import OrderedDict
+
+import numpy as np
+from nibabel import freesurfer as nfs
+
+
+def _distance_key(distance):
+    """Store distances as floats so 1 and 1.0 (and '-0.5' from the command line) compare equal."""
+    return float(distance)
+
+
+def empty_profiles(hemis, distances, metrics, n_vertices):
+    """Return a NaN-filled float32 array to fill, shaped (hemi, distance, vertex, metric)."""
+    max_vertices = max(n_vertices[i_hemi] for i_hemi in hemis)
+    return np.full((len(hemis), len(distances), max_vertices, len(metrics)), np.nan, dtype=np.float32)
+
+
+def save_profiles(prefix, data, subject, hemis, distances, metrics, n_vertices):
+    """
+    Write <prefix>.npy and <prefix>.json.
+    n_vertices is a dict of hemi -> number of vertices on that hemisphere's surface.
+    """
+    data = np.asarray(data, dtype=np.float32)
+    if data.shape[:2] != (len(hemis), len(distances)) or data.shape[3] != len(metrics):
+        raise ValueError('Profile array shape ' + str(data.shape) + ' does not match hemis/distances/metrics')
+
+    np.save(prefix + '.npy', data)
+
+    meta = OrderedDict()
+    meta['Subject'] = subject
+    meta['Hemis'] = list(hemis)
+    meta['Distances'] = [_distance_key(i_dist) for i_dist in distances]
+    meta['Metrics'] = list(metrics)
+    meta['N_Vertices'] = OrderedDict((i_hemi, int(n_vertices[i_hemi])) for i_hemi in hemis)
+    with open(prefix + '.json', 'w') as meta_file:
+        json.dump(meta, meta_file, indent=2)
+
+    print('Saved profile store to: ', prefix + '.npy')
+    return prefix + '.npy'
+
+
+def load_profiles(prefix, mmap_mode='r'):
+    """Return (array, metadata) for a store. The array is memory-mapped read-only by default."""
+    with open(prefix + '.json') as meta_file:
+        meta = json.load(meta_file, object_pairs_hook=OrderedDict)
+    data = np.load(prefix + '.npy', mmap_mode=mmap_mode)
+    return data, meta
+
+
+def pack_mgz_profiles(prefix, mgz_files, subject, hemis, distances, metrics):
+    """
+    Build a store from per hemi x distance x metric .mgz surface files.
+    mgz_files is a dict of (hemi, distance, metric) -> path.
+    """
+    # read each file once - vertex counts come from the files themselves
+    vertex_data = {}
+    n_vertices = {}
+    for i_hemi in hemis:
+        for i_dist in distances:
+            for i_metric in metrics:
+                i_data = np.asarray(nfs.mghformat.load(mgz_files[(i_hemi, i_dist, i_metric)]).dataobj).ravel()
+                if n_vertices.setdefault(i_hemi, len(i_data)) != len(i_data):
+                    raise ValueError('Different number of vertices in ' + mgz_files[(i_hemi, i_dist, i_metric)])
+                vertex_data[(i_hemi, i_dist, i_metric)] = i_data
+
+    data = empty_profiles(hemis, distances, metrics, n_vertices)
+    for h, i_hemi in enumerate(hemis):
+        for d, i_dist in enumerate(distances):
+            for m, i_metric in enumerate(metrics):
+                data[h, d, :n_vertices[i_hemi], m] = vertex_data[(i_hemi, i_dist, i_metric)]
+
+    return save_profiles(prefix, data, subject, hemis, distances, metrics, n_vertices)
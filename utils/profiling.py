@@ -0,0 +1,205 @@
+"""
+Stage-level timing and profiling shared by the pipeline scripts.
+
+Each script wraps its main steps (loading images, ROI loops, registration, writing csvs etc.) in
+``profiler.stage('name')`` blocks. With ``--profile`` every stage records:
+    Wall_s, CPU_s               wall time and CPU time of this (python) process
+    Child_CPU_s                 CPU time of child processes that finished during the stage (e.g. FreeSurfer commands)
+    Process_Bytes_Read/Written  bytes read/written by this process only (/proc/self/io, linux). I/O done by child
+                                processes (nipype/FreeSurfer/NiftyReg commands) is NOT included
+    Stage_Peak_Memory_MB        peak resident memory of this process during the stage (linux - the high-water mark is
+                                reset at the start of each stage), None where that is not possible
+    Max_Child_Memory_MB         largest peak resident memory of any child process finished so far (not per stage)
+Nipype workflows run with ``profiler.plugin_args(...)`` also record one entry per node (runtime, peak memory and CPU
+from nipype's resource monitor) so registration, resampling and each mri_vol2surf run can be told apart.
+A cProfile dump and a JSON trace are written next to the script outputs, which can be collated across a cohort with
+utils/aggregate_profiles.py.
+
+Author: Tom Veale (tom.veale@ucl.ac.uk)
+"""
+
+from __future__ import print_function
+
+import cProfile
+import json
+import os
+import platform
+import resource
+import sys
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+# perf_counter is python 3 only - extract_swm.py still runs under python 2 (niftypipe env)
+_wall_timer = getattr(time, 'perf_counter', time.time)
+
+
+def add_profile_args(parser):
+    """Add the --profile switch to a script's ArgumentParser."""
+    parser.add_argument('--profile',
+                        help='Write a cProfile dump (.prof) and a JSON trace of per-stage wall/CPU time, bytes '
+                             'read/written and peak memory (plus per-node nipype runtimes) next to the script outputs.',
+                        required=False,
+                        action='store_true')
+    return parser
+
+
+def _io_counters():
+    """Return (bytes read, bytes written) for this process from /proc/self/io, or (None, None) if unavailable."""
+    # rchar/wchar count bytes passed through read/write calls so they include files served from the page cache
+    try:
+        with open('/proc/self/io') as io_file:
+            counters = dict(line.split(':') for line in io_file)
+        return int(counters['rchar']), int(counters['wchar'])
+    except (IOError, OSError, KeyError, ValueError):
+        return None, None
+
+
+def _peak_memory_mb():
+    """Return peak resident memory (MB) of this process since it started and of its largest waited-for child."""
+    # ru_maxrss is in kilobytes on linux and bytes on macOS
+    scale = 1024.0 ** 2 if platform.system() == 'Darwin' else 1024.0
+    self_peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale
+    child_peak = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / scale
+    return self_peak, child_peak
+
+
+def _reset_stage_peak():
+    """Reset this process's resident memory high-water mark (linux). Returns False if not possible."""
+    try:
+        with open('/proc/self/clear_refs', 'w') as refs_file:
+            refs_file.write('5')
+        return True
+    except (IOError, OSError):
+        return False
+
+
+def _stage_peak_mb():
+    """Return the resident memory high-water mark (VmHWM, MB) since the last _reset_stage_peak, or None."""
+    try:
+        with open('/proc/self/status') as status_file:
+            for line in status_file:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024.0
+    except (IOError, OSError, ValueError):
+        pass
+    return None
+
+
+def _cpu_times():
+    """Return (CPU seconds of this process, CPU seconds of waited-for child processes)."""
+    self_usage = resource.getrusage(resource.RUSAGE_SELF)
+    child_usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return (self_usage.ru_utime + self_usage.ru_stime,
+            child_usage.ru_utime + child_usage.ru_stime)
+
+
+class StageProfiler(object):
+    """
+    Records per-stage resource usage for one run of a script (usually one subject).
+
+    Nothing is recorded unless enabled=True - stage() is then a no-op so scripts run exactly as before without
+    --profile.
+    """
+
+    def __init__(self, script_name, enabled=False):
+        self.script_name = script_name
+        self.enabled = enabled
+        self.stages = []
+        self.nodes = []
+        self._start_wall = time.time()
+        self._profile = cProfile.Profile() if enabled else None
+        if self._profile is not None:
+            self._profile.enable()
+
+    @contextmanager
+    def stage(self, name, **info):
+        """Context manager timing a named stage. Extra keyword arguments are stored in the trace (e.g. Hemi='lh')."""
+        if not self.enabled:
+            yield
+            return
+
+        wall_start = _wall_timer()
+        cpu_start, child_cpu_start = _cpu_times()
+        read_start, write_start = _io_counters()
+        peak_reset = _reset_stage_peak()
+        try:
+            yield
+        finally:
+            wall_end = _wall_timer()
+            cpu_end, child_cpu_end = _cpu_times()
+            read_end, write_end = _io_counters()
+            child_peak = _peak_memory_mb()[1]
+
+            i_stage = OrderedDict()
+            i_stage['Stage'] = name
+            i_stage['Wall_s'] = wall_end - wall_start
+            i_stage['CPU_s'] = cpu_end - cpu_start
+            i_stage['Child_CPU_s'] = child_cpu_end - child_cpu_start
+            i_stage['Process_Bytes_Read'] = read_end - read_start if read_start is not None else None
+            i_stage['Process_Bytes_Written'] = write_end - write_start if write_start is not None else None
+            i_stage['Stage_Peak_Memory_MB'] = _stage_peak_mb() if peak_reset else None
+            i_stage['Max_Child_Memory_MB'] = child_peak
+            i_stage.update(info)
+            self.stages.append(i_stage)
+
+    def plugin_args(self, plugin_args):
+        """
+        Return nipype plugin_args with a status_callback recording every node when profiling is enabled.
+        Call enable_nipype_monitor() before building the workflow so nodes also report peak memory/CPU.
+        """
+        plugin_args = dict(plugin_args)
+        if self.enabled:
+            plugin_args['status_callback'] = self._nipype_callback
+        return plugin_args
+
+    def enable_nipype_monitor(self):
+        """Turn on nipype's resource monitor (needs psutil) so node runtimes include peak memory and CPU usage."""
+        if self.enabled:
+            from nipype import config
+            config.enable_resource_monitor()
+
+    def _nipype_callback(self, node, status):
+        """nipype status_callback - records finished nodes with their runtime information."""
+        if status not in ('end', 'exception'):
+            return
+        i_node = OrderedDict()
+        i_node['Node'] = node.fullname
+        i_node['Status'] = status
+        try:
+            runtime = node.result.runtime
+        except Exception:
+            runtime = None
+        for i_key, i_field in [('Wall_s', 'duration'), ('Peak_Memory_GB', 'mem_peak_gb'),
+                               ('CPU_Percent', 'cpu_percent'), ('Start', 'startTime'), ('End', 'endTime')]:
+            i_node[i_key] = getattr(runtime, i_field, None)
+        self.nodes.append(i_node)
+
+    def write(self, out_prefix):
+        """
+        Stop cProfile and write <out_prefix>_profile.prof and <out_prefix>_trace.json.
+        Does nothing if profiling is not enabled. Returns the path to the JSON trace (or None).
+        """
+        if not self.enabled:
+            return None
+
+        self._profile.disable()
+        prof_fname = out_prefix + '_profile.prof'
+        self._profile.dump_stats(prof_fname)
+
+        trace = OrderedDict()
+        trace['Script'] = self.script_name
+        trace['Command'] = sys.argv
+        trace['Host'] = platform.node()
+        trace['Started'] = time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(self._start_wall))
+        trace['Total_Wall_s'] = time.time() - self._start_wall
+        trace['Process_Peak_Memory_MB'], trace['Max_Child_Memory_MB'] = _peak_memory_mb()
+        trace['cProfile'] = os.path.abspath(prof_fname)
+        trace['Stages'] = self.stages
+        trace['Nipype_Nodes'] = self.nodes
+
+        trace_fname = out_prefix + '_trace.json'
+        with open(trace_fname, 'w') as trace_file:
+            json.dump(trace, trace_file, indent=2)
+        print('Saved profiling trace to: ', trace_fname)
+        return trace_fname
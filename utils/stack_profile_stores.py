@@ -0,0 +1,106 @@
+# stacks per-subject profile stores (see utils/profile_store.py) into one cohort array for group statistics
+# e.g. np.nanmean(cohort[patients], axis=0) - np.nanmean(cohort[controls], axis=0) at every hemi/distance/vertex
+
+# load packages
+import os
+import sys
+import json
+import numpy as np
+from argparse import ArgumentParser, RawDescriptionHelpFormatter
+from collections import OrderedDict
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from utils.profile_store import load_profiles
+
+# get arguments
+__description__ = '''
+This script collates all per-subject profile stores (<prefix>.npy + <prefix>.json) under a parent directory into one
+float32 array of shape (subject, hemi, distance, vertex, metric) plus a json listing subjects and metadata.
+Subjects are memory-mapped one at a time and written into a memory-mapped output, so the cohort never has to fit in
+memory. All stores must share hemis, distances and metrics, and by default the same number of vertices per hemisphere,
+i.e. be sampled to a common template (e.g. fsaverage, extract_swm.py *_swm_profiles_template stores) so vertex v is the
+same location in every subject - by default only *_profiles_template.npy stores are collected. Native-space stores
+(*_swm_profiles, pack_profiles.py) are on each subject's own surface and are only stacked with e.g.
+-ew _profiles.npy --allow_native (padded with NaN) - don't use those for vertex-wise group statistics.
+Stores for different metrics (e.g. NDI and ODI from extract_swm.py) must be stacked separately - include the metric in
+-ew (e.g. -ew NDI_swm_profiles_template.npy).
+
+Author: Tom Veale
+Email: tom.veale@ucl.ac.uk
+'''
+
+# collect inputs
+parser = ArgumentParser(formatter_class=RawDescriptionHelpFormatter,
+                        description=__description__)
+
+parser.add_argument('-pd', '--parent_dir',
+                    help='Path to the parent data directory the stores are located in (BIDS preferred)',
+                    required=True)
+parser.add_argument('-ew', '--ends_with',
+                    help='Common string that all the stores end with. Must pick out a single metric if the tree '
+                         'holds stores for several (e.g. \'NDI_swm_profiles_template.npy\'). '
+                         'Default is \'_profiles_template.npy\' (template-space stores)',
+                    required=False,
+                    default='_profiles_template.npy')
+parser.add_argument('-o', '--output',
+                    help='Output cohort file name (without extension). Saved in parentdir.',
+                    required=False,
+                    default='cohort_profiles')
+parser.add_argument('--allow_native',
+                    help='Allow stores with different numbers of vertices (native surfaces). These are padded with NaN '
+                         'and vertex indices do NOT correspond across subjects.',
+                    required=False,
+                    action='store_true')
+args = parser.parse_args()
+
+# get list of stores (prefixes without .npy) - skipping any previous cohort output
+store_list = []
+indir = os.path.abspath(args.parent_dir)
+out_prefix = os.path.join(indir, args.output)
+for root, dirs, files in os.walk(indir):
+    for ifile in sorted(files):
+        if os.path.join(root, ifile[:-4]) == out_prefix:
+            continue
+        if ifile.endswith(args.ends_with) and os.path.exists(os.path.join(root, ifile[:-4] + '.json')):
+            print(os.path.join(root, ifile))
+            store_list.append(os.path.join(root, ifile[:-4]))
+
+store_list = sorted(store_list)
+if not store_list:
+    raise ValueError('No profile stores ending with ' + args.ends_with + ' found under ' + indir)
+
+# check metadata agrees across subjects before allocating the cohort array
+meta_list = [load_profiles(istore)[1] for istore in store_list]
+ref_meta = meta_list[0]
+for istore, i_meta in zip(store_list, meta_list):
+    for i_key in ['Hemis', 'Distances', 'Metrics']:
+        if i_meta[i_key] != ref_meta[i_key]:
+            raise ValueError(i_key + ' in ' + istore + ' do not match ' + store_list[0] +
+                             ' - stack one metric at a time by including it in --ends_with')
+    if i_meta['N_Vertices'] != ref_meta['N_Vertices'] and not args.allow_native:
+        raise ValueError('Number of vertices in ' + istore + ' ' + str(dict(i_meta['N_Vertices'])) + ' do not match ' +
+                         store_list[0] + ' ' + str(dict(ref_meta['N_Vertices'])) + ' - stores look like they are on '
+                         'native surfaces. Sample to a common template or use --allow_native.')
+max_vertices = max(max(i_meta['N_Vertices'].values()) for i_meta in meta_list)
+
+# memory-mapped cohort array - filled one subject at a time
+cohort = np.lib.format.open_memmap(out_prefix + '.npy', mode='w+', dtype=np.float32,
+                                   shape=(len(store_list), len(ref_meta['Hemis']), len(ref_meta['Distances']),
+                                          max_vertices, len(ref_meta['Metrics'])))
+cohort[:] = np.nan
+for s, istore in enumerate(store_list):
+    i_data = load_profiles(istore)[0]
+    cohort[s, :, :, :i_data.shape[2], :] = i_data
+cohort.flush()
+
+cohort_meta = OrderedDict()
+cohort_meta['Subjects'] = [i_meta['Subject'] for i_meta in meta_list]
+cohort_meta['Stores'] = store_list
+cohort_meta['Hemis'] = ref_meta['Hemis']
+cohort_meta['Distances'] = ref_meta['Distances']
+cohort_meta['Metrics'] = ref_meta['Metrics']
+cohort_meta['N_Vertices'] = [i_meta['N_Vertices'] for i_meta in meta_list]
+with open(out_prefix + '.json', 'w') as meta_file:
+    json.dump(cohort_meta, meta_file, indent=2)
+
+print('Saved cohort profiles ' + str(cohort.shape) + ' to: ', out_prefix + '.npy')
@@ -0,0 +1,51 @@
+"""
+Volume <-> FreeSurfer surface geometry helpers shared by the 7-Chapter surface scripts.
+
+Author: Tom Veale (tom.veale@ucl.ac.uk)
+"""
+
+import warnings
+
+import nibabel as nb
+import numpy as np
+
+
+def vox2ras_tkr(img):
+    """Voxel -> FreeSurfer tkr (surface) RAS matrix for any image: same rotation/zooms, volume centre at the origin."""
+    affine = img.affine.copy()
+    centre = np.array(img.shape[:3]) / 2.0
+    affine[:3, 3] = -affine[:3, :3].dot(centre)
+    return affine
+
+
+def surface_ras2vox(img, vol_info):
+    """
+    Surface (tkr RAS) -> voxel matrix for img, using the volume_info stored in the surface
+    (nibabel.freesurfer.read_geometry(..., read_metadata=True)). Surface tkr RAS is scanner RAS shifted by the cras of
+    the volume the surface was made from (e.g. orig.mgz for white, the SynthSeg image for synth_white), so img does
+    not need to be on the same grid as that volume. Without volume_info img must be that volume - its own tkr matrix
+    is used and a warning is given.
+    """
+    if 'cras' not in vol_info:
+        warnings.warn('Surface has no volume info - assuming the image is on the grid the surface was made from',
+                      UserWarning)
+        return np.linalg.inv(vox2ras_tkr(img))
+    tkr2scanner = np.eye(4)
+    tkr2scanner[:3, 3] = vol_info['cras']
+    return np.linalg.inv(img.affine).dot(tkr2scanner)
+
+
+def volume_info(img, filename):
+    """Volume geometry stored in a surface file so viewers can place it on the image it was made from."""
+    zooms = np.array(img.header.get_zooms()[:3])
+    mdc = img.affine[:3, :3] / zooms
+    info = {'head': np.array([2, 0, 20]),
+            'valid': '1  # volume info valid',
+            'filename': filename,
+            'volume': np.array(img.shape[:3]),
+            'voxelsize': zooms,
+            'xras': mdc[:, 0],
+            'yras': mdc[:, 1],
+            'zras': mdc[:, 2],
+            'cras': nb.affines.apply_affine(img.affine, np.array(img.shape[:3]) / 2.0)}
+    return info